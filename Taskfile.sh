@@ -52,7 +52,10 @@ deploy() {
   gcloud auth configure-docker europe-west3-docker.pkg.dev
   docker build --platform linux/amd64 --tag ${IMAGE_TAG} .
   docker push ${IMAGE_TAG}
-  gcloud run deploy ${NAME} --image ${IMAGE_TAG} --platform managed --timeout 60 --memory 128Mi --service-account=${SERVICE_ACCOUNT} --region europe-west3
+  # jobs run in the background after the response and their state lives in memory:
+  # keep the CPU allocated between requests, keep the instance alive while no requests are in flight
+  # and route every /status poll to the one instance
+  gcloud run deploy ${NAME} --image ${IMAGE_TAG} --platform managed --timeout 60 --memory 128Mi --service-account=${SERVICE_ACCOUNT} --region europe-west3 --no-cpu-throttling --min-instances 1 --max-instances 1
 }
 
 # END tasks
@@ -1,11 +1,29 @@
-from typing import Tuple, List
+from typing import IO, Tuple, List, Optional, Sequence, Union
+import functools
+import http.client
+import io
+import json
 import os
+import diskcache
 import pytube
 import srt
 from pydub.utils import mediainfo
+import requests
+import shutil
+import socket
 import subprocess
+import tenacity
+import threading
+import time
+import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlparse
 
 from google.cloud import storage
+from google.cloud.storage import transfer_manager
+from google.cloud.storage.fileio import BlobWriter
 from src.common import logger
 
 from dotenv import load_dotenv
@@ -14,26 +32,83 @@ from dotenv import load_dotenv
 load_dotenv()
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 
+# resumable uploads are sent in chunks of this size (must be a multiple of 256 KiB)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
 
-def check_payload_fields(expected_fields: list, payload: dict) -> str:
+# files above this size are transferred in parallel chunks of TRANSFER_CHUNK_SIZE
+CHUNKED_TRANSFER_THRESHOLD = 150 * 1024 * 1024
+TRANSFER_CHUNK_SIZE = 32 * 1024 * 1024
+TRANSFER_MAX_WORKERS = 8
+
+# extensions of local files removed by clean_up
+CLEAN_UP_EXTENSIONS = frozenset({".wav", ".mp4", ".srt", ".txt"})
+
+# audio properties stored as custom metadata on uploaded video blobs
+VIDEO_INFO_KEYS = ("channels", "bit_rate", "sample_rate", "duration")
+
+# persistent cache of mediainfo results, survives process restarts on the same host
+_MEDIAINFO_CACHE = diskcache.Cache("/tmp/mediainfo_cache")
+
+# stream URLs per YouTube video id, dropped this long before the URL itself expires
+_YOUTUBE_STREAM_CACHE = diskcache.Cache("/tmp/yt_meta")
+YOUTUBE_STREAM_EXPIRY_MARGIN_SECS = 600
+
+# pooled keep-alive session for all HTTP requests pytube makes, with (connect, read) timeouts so a stalled
+# connection fails instead of blocking the job worker
+PYTUBE_REQUEST_TIMEOUT_SECS = (10, 60)
+_HTTP_SESSION = requests.Session()
+_HTTP_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=10,
+                                            max_retries=Retry(total=3, backoff_factor=0.3)))
+
+# shared client, so auth, HTTP session and TLS connections are reused across calls.
+# It is created on first use, so the module can be imported without credentials.
+_CLIENT: Optional[storage.Client] = None
+_BUCKET: Optional[storage.Bucket] = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def _get_client() -> storage.Client:
+    """
+    Return the shared storage client and bucket handle of BUCKET_NAME, creating them on the first call.
+    """
+    global _CLIENT, _BUCKET
+    with _CLIENT_LOCK:
+        if _CLIENT is None:
+            _CLIENT = storage.Client()
+            _BUCKET = _CLIENT.bucket(BUCKET_NAME)
+    return _CLIENT
+
+
+def _get_bucket(bucket_name: str, client: Optional[storage.Client] = None) -> storage.Bucket:
+    """
+    Return a handle for the given bucket, reusing the module-level client and bucket where possible.
+    """
+    if client is None and bucket_name == BUCKET_NAME:
+        _get_client()
+        return _BUCKET
+    return (client or _get_client()).bucket(bucket_name)
+
+
+def check_payload_fields(expected_fields: Sequence[str], payload: dict) -> str:
     """
     This function checks if all expected fields are present in the payload.
     :param expected_fields:
     :param payload:
     :return:
     """
-
-    for param in expected_fields:
-        if param not in payload:
-            msg = f"Required field {param} is missing in request. Request needs parameters {expected_fields}"
-            logger.error(msg)
-            return msg
+    missing = [param for param in expected_fields if param not in payload]
 
     # if all required fields are present, return empty string
-    return ""
+    if not missing:
+        return ""
 
+    msg = f"Required field {missing[0]} is missing in request. Request needs parameters {list(expected_fields)}"
+    logger.error(msg)
+    return msg
 
-def upload_blob(bucket_name: str, source_file_name: str, destination_blob_name: str) -> None:
+
+def upload_blob(bucket_name: str, source_file_name: str, destination_blob_name: str,
+                metadata: Optional[dict] = None, client: Optional[storage.Client] = None) -> None:
     """
     Uploads a file to the specified bucket.
 
@@ -41,6 +116,8 @@ def upload_blob(bucket_name: str, source_file_name: str, destination_blob_name:
         bucket_name (str): The name of the GCS bucket.
         source_file_name (str): The local path to the file to upload.
         destination_blob_name (str): The name to give to the uploaded blob.
+        metadata (dict, optional): Custom metadata to store on the uploaded blob. Defaults to None.
+        client (storage.Client, optional): The client to use. Defaults to the shared module-level client.
 
     Returns:
         None
@@ -49,16 +126,25 @@ def upload_blob(bucket_name: str, source_file_name: str, destination_blob_name:
         Exception: If there is an error in uploading the file.
 
     """
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
+    bucket = _get_bucket(bucket_name, client)
     blob = bucket.blob(destination_blob_name)
-
-    blob.upload_from_filename(source_file_name)
+    if metadata is not None:
+        # the XML multipart upload cannot serialize an explicit None
+        blob.metadata = metadata
+
+    if os.path.getsize(source_file_name) > CHUNKED_TRANSFER_THRESHOLD:
+        # XML multipart upload of large files, e.g. videos
+        transfer_manager.upload_chunks_concurrently(source_file_name, blob, chunk_size=TRANSFER_CHUNK_SIZE,
+                                                    worker_type=transfer_manager.THREAD,
+                                                    max_workers=TRANSFER_MAX_WORKERS)
+    else:
+        blob.upload_from_filename(source_file_name)
 
     print(f"File {source_file_name} uploaded to {destination_blob_name}.")
 
 
-def download_blob(bucket_name: str, source_blob_name: str, destination_file_name: str) -> None:
+def download_blob(bucket_name: str, source_blob_name: str, destination_file_name: str,
+                  client: Optional[storage.Client] = None) -> None:
     """
     Downloads a blob from the specified bucket.
 
@@ -66,6 +152,7 @@ def download_blob(bucket_name: str, source_blob_name: str, destination_file_name
         bucket_name (str): The name of the GCS bucket.
         source_blob_name (str): The name of the blob to download.
         destination_file_name (str): The local path where the file should be saved.
+        client (storage.Client, optional): The client to use. Defaults to the shared module-level client.
 
     Returns:
         None
@@ -74,26 +161,65 @@ def download_blob(bucket_name: str, source_blob_name: str, destination_file_name
         Exception: If there is an error in downloading the blob.
 
     """
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
+    bucket = _get_bucket(bucket_name, client)
 
-    # Construct a client-side representation of the blob
+    # Construct a client-side representation of the blob and fetch its size
     blob = bucket.blob(source_blob_name)
+    blob.reload()
 
     # Download the blob to the specified destination file
-    blob.download_to_filename(destination_file_name)
+    if blob.size > CHUNKED_TRANSFER_THRESHOLD:
+        transfer_manager.download_chunks_concurrently(blob, destination_file_name, chunk_size=TRANSFER_CHUNK_SIZE,
+                                                      worker_type=transfer_manager.THREAD,
+                                                      max_workers=TRANSFER_MAX_WORKERS)
+    else:
+        blob.download_to_filename(destination_file_name)
 
     print(
         f"Downloaded storage object {source_blob_name} from bucket {bucket_name} to local file {destination_file_name}.")
 
 
-def download_blob_to_text_file(bucket_name: str, source_blob_name: str) -> str:
+def upload_blobs(bucket_name: str, file_blob_names: List[Tuple[Union[str, IO], str]],
+                 content_type: Optional[str] = None, client: Optional[storage.Client] = None) -> None:
+    """
+    Uploads several files to the specified bucket concurrently.
+
+    Args:
+        bucket_name (str): The name of the GCS bucket.
+        file_blob_names (List[Tuple[Union[str, IO], str]]): Pairs of a local path or file object positioned at its
+            start, and the name to give to the uploaded blob.
+        content_type (str, optional): The content type of all uploaded blobs. Defaults to None, i.e. guessed from the
+            filename, which falls back to application/octet-stream for file objects.
+        client (storage.Client, optional): The client to use. Defaults to the shared module-level client.
+
+    Returns:
+        None
+
+    Raises:
+        Exception: If there is an error in uploading any of the files.
+
+    """
+    bucket = _get_bucket(bucket_name, client)
+    file_blob_pairs = [(file, bucket.blob(blob_name)) for file, blob_name in file_blob_names]
+
+    # file objects are only supported with thread workers, one worker per file
+    upload_kwargs = {"content_type": content_type} if content_type is not None else None
+    transfer_manager.upload_many(file_blob_pairs, upload_kwargs=upload_kwargs, raise_exception=True,
+                                 worker_type=transfer_manager.THREAD,
+                                 max_workers=min(len(file_blob_pairs), TRANSFER_MAX_WORKERS))
+
+    print(f"Files uploaded to {[blob_name for _, blob_name in file_blob_names]}.")
+
+
+def download_blob_to_text_file(bucket_name: str, source_blob_name: str,
+                               client: Optional[storage.Client] = None) -> str:
     """
     Downloads a blob from the specified bucket and returns its contents as text.
 
     Args:
         bucket_name (str): The name of the GCS bucket.
         source_blob_name (str): The name of the blob to download.
+        client (storage.Client, optional): The client to use. Defaults to the shared module-level client.
 
     Returns:
         str: The contents of the downloaded blob as text.
@@ -102,83 +228,220 @@ def download_blob_to_text_file(bucket_name: str, source_blob_name: str) -> str:
         Exception: If there is an error in downloading the blob.
 
     """
-    storage_client = storage.Client()
+    # Download the raw blob contents in memory and decode them, no temporary file involved
+    return _get_bucket(bucket_name, client).blob(source_blob_name).download_as_bytes().decode("utf-8")
 
-    bucket = storage_client.bucket(bucket_name)
 
-    # Construct a client-side representation of the blob
-    blob = bucket.blob(source_blob_name)
+def _execute_pytube_request(url: str, method: Optional[str] = None, headers: Optional[dict] = None,
+                            data=None, timeout=socket._GLOBAL_DEFAULT_TIMEOUT):
+    """
+    Replacement for pytube.request._execute_request that sends the request through the pooled session instead of
+    opening a new connection with urlopen. The raw response offers the read() and info() calls pytube relies on.
+    """
+    base_headers = {"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"}
+    if headers:
+        base_headers.update(headers)
+    if data and not isinstance(data, bytes):
+        # encode data for request
+        data = bytes(json.dumps(data), encoding="utf-8")
+    if not url.lower().startswith("http"):
+        raise ValueError("Invalid URL")
+    if timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+        timeout = PYTUBE_REQUEST_TIMEOUT_SECS
 
-    # Download the blob contents as text
-    file_contents = blob.download_as_text()
+    response = _HTTP_SESSION.request(method or ("POST" if data else "GET"), url, headers=base_headers, data=data,
+                                     timeout=timeout, stream=True)
+    if response.status_code >= 400:
+        # pytube handles HTTP errors as raised by urlopen
+        response.close()
+        raise HTTPError(url, response.status_code, response.reason, response.headers, None)
 
-    return file_contents
+    response.raw.decode_content = True
+    return response.raw
+
+
+pytube.request._execute_request = _execute_pytube_request
+
+
+def _get_youtube_stream_url(link: str, refresh: bool = False) -> str:
+    """
+    Return the URL of the highest resolution progressive mp4 stream of a YouTube video.
+
+    The URL is cached on disk per video id until shortly before YouTube lets it expire, so repeated requests for the
+    same video skip fetching and deciphering the video page. With refresh, the cached URL is dropped and resolved
+    again.
+    """
+    video_id = pytube.extract.video_id(link)
+    if refresh:
+        _YOUTUBE_STREAM_CACHE.delete(video_id)
+    stream_url = _YOUTUBE_STREAM_CACHE.get(video_id)
+    if stream_url is not None:
+        return stream_url
 
+    stream_url = pytube.YouTube(link).streams.filter(progressive=True, file_extension='mp4').order_by(
+        'resolution').desc().first().url
 
+    # the signed stream URL carries its expiry time as a unix timestamp
+    expire = int(parse_qs(urlparse(stream_url).query).get("expire", ["0"])[0])
+    ttl = expire - time.time() - YOUTUBE_STREAM_EXPIRY_MARGIN_SECS
+    if ttl > 0:
+        _YOUTUBE_STREAM_CACHE.set(video_id, stream_url, expire=ttl)
+
+    return stream_url
+
+
+def _download_youtube_stream(stream_url: str, path: str) -> None:
+    """
+    Write a YouTube stream to a local file, fetched in ranged chunks to avoid throttling.
+    """
+    with open(path, "wb") as f:
+        for chunk in pytube.request.stream(stream_url):
+            f.write(chunk)
+
+
+# connection failures and timeouts while sending the request, and connections dropped or stalled while reading the body
+@tenacity.retry(retry=tenacity.retry_if_exception_type((ConnectionError, requests.ConnectionError, requests.Timeout,
+                                                        urllib3.exceptions.ProtocolError,
+                                                        urllib3.exceptions.ReadTimeoutError,
+                                                        http.client.IncompleteRead)),
+                stop=tenacity.stop_after_attempt(3), wait=tenacity.wait_exponential(), reraise=True)
 def download_youtube_video(link: str, video_filename: str) -> str:
     """
-    Download a YouTube video given its link and rename the downloaded file.
+    Download a YouTube video given its link. Dropped or stalled connections are retried up to three times.
+
+    The video is downloaded to a partial file next to the target, which is then atomically renamed, so an interrupted
+    download never leaves a truncated video behind.
 
     Args:
         link (str): The YouTube video link.
         video_filename (str): The desired filename for the downloaded video.
 
     Returns:
-        str: The local path of the renamed video file.
+        str: The local path of the downloaded video file.
 
     Raises:
-        Exception: If there is an error in downloading or renaming the video.
+        Exception: If there is an error in downloading the video.
 
     """
-    try:
-        # Create a YouTube object using the provided link
-        yt = pytube.YouTube(link)
-    except:
-        print("Connection Error")  # Handle connection exception
+    video_path_local = os.path.abspath(video_filename)
+    partial_path = os.path.join(os.path.dirname(video_path_local), f".{os.path.basename(video_path_local)}.part")
 
     # Download the video with the highest resolution in mp4 format
-    video_path = yt.streams.filter(progressive=True, file_extension='mp4').order_by(
-        'resolution').desc().first().download()
+    try:
+        try:
+            _download_youtube_stream(_get_youtube_stream_url(link), partial_path)
+        except HTTPError:
+            # a cached URL may have been revoked or be bound to another client IP, resolve it again once
+            _download_youtube_stream(_get_youtube_stream_url(link, refresh=True), partial_path)
+    except Exception:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+
+    # Move the downloaded video file into place, replacing an existing one
+    os.replace(partial_path, video_path_local)
+
+    return video_path_local
+
+
+# versioned cache name: entries written before the duration was added hold 3-tuples
+@functools.lru_cache(maxsize=32)
+@_MEDIAINFO_CACHE.memoize(name="_probe_video_info_v2")
+def _probe_video_info(video_filepath: str, size: int, mtime_ns: int) -> Tuple[int, int, int, float]:
+    """
+    Run mediainfo on a video file. Size and modification time are part of the cache key only, so a file that is
+    replaced under the same path is probed again.
+    """
+    video_data = mediainfo(video_filepath)
 
-    # Rename the downloaded video file
-    new_path_local = video_path.split('/')
-    new_filename = video_filename
-    new_path_local[-1] = new_filename
-    new_path_local = '/'.join(new_path_local)
-    os.rename(video_path, new_path_local)
+    # Extract required information
+    channels = video_data["channels"]
+    bit_rate = video_data["bit_rate"]
+    sample_rate = video_data["sample_rate"]
+    duration = video_data["duration"]
 
-    return new_path_local
+    return channels, bit_rate, sample_rate, duration
 
 
-def get_video_info(video_filepath: str) -> Tuple[int, int, int]:
+def get_video_info(video_filepath: str) -> Tuple[int, int, int, float]:
     """
-    Retrieve the number of channels, bit rate, and sample rate of a video file.
+    Retrieve the number of channels, bit rate, sample rate and duration in seconds of a video file.
+
+    Results are cached in memory and on disk, keyed on the path, size and modification time of the file.
 
     Args:
         video_filepath (str): The path to the video file.
 
     Returns:
-        Tuple[int, int, int]: A tuple containing the number of channels, bit rate, and sample rate.
+        Tuple[int, int, int, float]: A tuple containing the number of channels, bit rate, sample rate and duration.
 
     Raises:
         Exception: If there is an error in retrieving the video information.
 
     """
-    # Retrieve video information using mediainfo tool
-    video_data = mediainfo(video_filepath)
+    stat = os.stat(video_filepath)
+    return _probe_video_info(video_filepath, stat.st_size, stat.st_mtime_ns)
 
-    # Extract required information
-    channels = video_data["channels"]
-    bit_rate = video_data["bit_rate"]
-    sample_rate = video_data["sample_rate"]
 
-    return channels, bit_rate, sample_rate
+def get_blob_video_info(bucket_name: str, blob_name: str,
+                        client: Optional[storage.Client] = None) -> Optional[Tuple[int, int, int, float]]:
+    """
+    Retrieve the number of channels, bit rate, sample rate and duration stored in the metadata of a video blob.
+
+    Args:
+        bucket_name (str): The name of the GCS bucket.
+        blob_name (str): The name of the video blob.
+        client (storage.Client, optional): The client to use. Defaults to the shared module-level client.
+
+    Returns:
+        Optional[Tuple[int, int, int, float]]: The stored video information, or None if the blob carries none.
+
+    """
+    blob = _get_bucket(bucket_name, client).blob(blob_name)
+    blob.reload()
+
+    metadata = blob.metadata or {}
+    if not all(key in metadata for key in VIDEO_INFO_KEYS):
+        return None
+
+    return tuple(metadata[key] for key in VIDEO_INFO_KEYS)
+
+
+def set_blob_video_info(bucket_name: str, blob_name: str, video_info: Tuple[int, int, int, float],
+                        client: Optional[storage.Client] = None) -> None:
+    """
+    Store the number of channels, bit rate, sample rate and duration in the metadata of a video blob.
+
+    Args:
+        bucket_name (str): The name of the GCS bucket.
+        blob_name (str): The name of the video blob.
+        video_info (Tuple[int, int, int, float]): The video information as returned by get_video_info.
+        client (storage.Client, optional): The client to use. Defaults to the shared module-level client.
+
+    Returns:
+        None
+
+    """
+    blob = _get_bucket(bucket_name, client).blob(blob_name)
+    blob.metadata = dict(zip(VIDEO_INFO_KEYS, video_info))
+    blob.patch()
+
+
+def _abort_blob_writer(writer: BlobWriter) -> None:
+    """
+    Discard a blob writer without finalizing its upload. The size of the upload is only sent with the last chunk on
+    close(), so the object is never committed and any previous version of the blob is left untouched.
+    """
+    writer._buffer.close()
 
 
 def video_to_audio(video_filepath: str, audio_filename: str, video_channels: int, video_bit_rate: str,
-                   video_sample_rate: int) -> str:
+                   video_sample_rate: int, start: float = 0.0, duration: Optional[float] = None) -> None:
     """
-    Converts a video file to an audio file and uploads it to Cloud Storage.
+    Converts a video file, or a time window of it, to an audio file and streams it to Cloud Storage.
+
+    ffmpeg writes the WAV container to its stdout, which is piped straight into a resumable upload, so the transcode
+    overlaps with the network transfer and the audio never touches the local disk.
 
     Args:
         video_filepath (str): The filepath of the video file.
@@ -186,8 +449,11 @@ def video_to_audio(video_filepath: str, audio_filename: str, video_channels: int
         video_channels (int): The number of audio channels in the video.
         video_bit_rate (str): The desired audio bit rate of the output audio file.
         video_sample_rate (int): The desired audio sample rate of the output audio file.
+        start (float, optional): The offset in seconds at which the audio starts. Defaults to 0.0.
+        duration (float, optional): The length of the audio in seconds. Defaults to None, i.e. until the end.
 
     In the ffmpeg command, the arguments have the following meanings:
+        -ss {start}: Seeks the input to the given offset in seconds before decoding.
         -i {video_filepath}: Specifies the input video
             file path.
         -b:a {video_bit_rate}: Sets the audio bit rate for the output audio file. The {video_bit_rate}
@@ -197,46 +463,92 @@ def video_to_audio(video_filepath: str, audio_filename: str, video_channels: int
             placeholder should be replaced with the desired number of channels.
         -ar {video_sample_rate}: Sets the audio sample rate for the output audio file, specified in hertz (Hz).
             The {video_sample_rate} placeholder should be replaced with the desired sample rate value.
-        -vn: Disables video recording, indicating that only the audio should be processed. {audio_filename}: Specifies
-            the output audio file name. -y: Automatically overwrites the output file if it already exists without
-            prompting for confirmation.
+        -t {duration}: Limits the output audio to the given length in seconds, if a duration is given.
+        -vn: Disables video recording, indicating that only the audio should be processed.
+        -f wav pipe:1: Writes the output as a WAV container to stdout.
+
+    The audio is uploaded to the blob audios/{audio_filename} in BUCKET_NAME. If ffmpeg fails, the upload is aborted
+    and the blob is left unchanged.
 
     Returns:
-        str: The GCS URI of the uploaded audio file.
+        None
+
+    Raises:
+        subprocess.CalledProcessError: If ffmpeg exits with a non-zero return code.
     """
-    command = f"ffmpeg -i {video_filepath} -b:a {video_bit_rate} -ac {video_channels} -ar {video_sample_rate} -vn {audio_filename} -y"
-    subprocess.call(command, shell=True)
+    command = ["ffmpeg", "-ss", str(start), "-i", video_filepath, "-b:a", str(video_bit_rate),
+               "-ac", str(video_channels), "-ar", str(video_sample_rate), "-vn"]
+    if duration is not None:
+        command += ["-t", str(duration)]
+    command += ["-f", "wav", "pipe:1"]
     blob_name = f"audios/{audio_filename}"
-    upload_blob(BUCKET_NAME, audio_filename, blob_name)
-    gcs_uri = f"gs://{BUCKET_NAME}/{blob_name}"
 
-    return gcs_uri
+    blob = _get_bucket(BUCKET_NAME).blob(blob_name)
+
+    writer = blob.open("wb", chunk_size=UPLOAD_CHUNK_SIZE, content_type="audio/wav")
+    with subprocess.Popen(command, stdout=subprocess.PIPE) as proc:
+        try:
+            shutil.copyfileobj(proc.stdout, writer, UPLOAD_CHUNK_SIZE)
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, command)
+        except BaseException:
+            proc.kill()
+            _abort_blob_writer(writer)
+            raise
+    writer.close()
+
+    print(f"Audio of {video_filepath} streamed to {blob_name}.")
+
+
+def write_srt(subtitles: List[srt.Subtitle], language: str = "de") -> Tuple[io.BytesIO, str]:
+    """
+    Write subtitles to an in-memory SRT file, to be uploaded with upload_blobs.
+
+    Subtitles are encoded one at a time, so the full SRT document is never built as a single string. As with
+    srt.compose, they are sorted and renumbered, and empty or zero-length subtitles are skipped.
+
+    Args:
+        subtitles (List[srt.Subtitle]): The list of subtitle objects.
+        language (str, optional): The language code for the subtitles. Defaults to "de".
+
+    Returns:
+        Tuple[io.BytesIO, str]: The UTF-8 encoded SRT file, positioned at its start, and its blob name.
+    """
+    print(f"Writing {language} subtitles")
+    srt_file = io.BytesIO()
+    for subtitle in srt.sort_and_reindex(subtitles):
+        srt_file.write(subtitle.to_srt().encode("utf-8"))
+    srt_file.seek(0)
 
+    return srt_file, f"subtitles/{language}.srt"
 
-def write_srt(bucket_name: str, subtitles: List[srt.Subtitle], language: str = "de") -> None:
+
+def write_txt(bucket_name: str, subtitles: List[srt.Subtitle], language: str = "de",
+              client: Optional[storage.Client] = None) -> None:
     """
-    Write subtitles to an SRT file and upload it to Google Cloud Storage.
+    Write the subtitle contents, one subtitle per line, to a text file in Google Cloud Storage.
+
+    The file is the input of the batch translation; update_srt relies on the translated lines matching the
+    subtitles one to one.
 
     Args:
         bucket_name (str): The name of the Google Cloud Storage bucket.
         subtitles (List[srt.Subtitle]): The list of subtitle objects.
         language (str, optional): The language code for the subtitles. Defaults to "de".
+        client (storage.Client, optional): The client to use. Defaults to the shared module-level client.
 
     Returns:
         None
     """
-    # Write locally
-    srt_file = f"{language}.srt"
-    print(f"Writing {language} subtitles to: {srt_file}")
-    with open(srt_file, 'w', encoding="utf-8") as f:
-        f.writelines(srt.compose(subtitles))
+    txt_file = io.BytesIO()
+    for subtitle in subtitles:
+        txt_file.write(subtitle.content.replace("\n", " ").encode("utf-8") + b"\n")
 
-    # Upload to Google Cloud Storage
-    blob_name = f"subtitles/{language}.srt"
-    upload_blob(bucket_name, srt_file, blob_name)
+    blob_name = f"texts/{language}.txt"
+    blob = _get_bucket(bucket_name, client).blob(blob_name)
+    blob.upload_from_file(txt_file, rewind=True, content_type="text/plain")
 
-    # Clean up local file
-    os.remove(srt_file)
+    print(f"Text of {language} subtitles uploaded to {blob_name}.")
 
 
 def update_srt(original_subtitles: List[srt.Subtitle], translated_text: str) -> List[srt.Subtitle]:
@@ -250,23 +562,30 @@ def update_srt(original_subtitles: List[srt.Subtitle], translated_text: str) ->
     Returns:
         List[srt.Subtitle]: The updated original subtitles.
     """
-    lines = translated_text.split("\n")
-    i = 0
-    # todo: Find a better way to handle the last line ('') instead of using [:-1].
-    for line in lines[:-1]:
-        original_subtitles[i].content = line
-        i += 1
+    # splitlines() drops the trailing empty line, empty lines keep the original content
+    for subtitle, line in zip(original_subtitles, translated_text.splitlines()):
+        if line:
+            subtitle.content = line
     return original_subtitles
 
 
-def clean_up() -> None:
+def clean_up(paths: Optional[List[str]] = None) -> None:
     """
-    Deletes all files ending with *.wav, *.mp4, *.srt, and *.txt in the current directory.
-    """
-    extensions = (".wav", ".mp4", ".srt", ".txt")
-    current_dir = os.getcwd()
+    Deletes the given files, or all files ending with *.wav, *.mp4, *.srt, and *.txt in the current directory if
+    no files are given.
 
-    for file in os.listdir(current_dir):
-        if file.endswith(extensions):
-            file_path = os.path.join(current_dir, file)
-            os.remove(file_path)
+    Args:
+        paths (List[str], optional): The local files created by the request. Defaults to None.
+    """
+    if paths is not None:
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        return
+
+    with os.scandir(os.getcwd()) as entries:
+        for entry in entries:
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in CLEAN_UP_EXTENSIONS:
+                os.unlink(entry.path)
@@ -1,4 +1,10 @@
+import functools
+import json
 import os
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict
 
 from flask import Flask, Response, request
 from flask_cors import CORS
@@ -19,6 +25,7 @@ response_headers = {
     "Access-Control-Allow-Origin": "*",
     "Content-Type": "application/json",
 }
+_response = functools.partial(Response, headers=response_headers)
 
 # load env vars
 load_dotenv()
@@ -26,58 +33,117 @@ PROJECT_ID = os.getenv("PROJECT_ID")
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 location = "global"
 
+# required payload fields per endpoint
+YOUTUBE_REQUIRED_FIELDS = ("link", "language_code", "source_language", "target_language")
+VIDEO_FILE_REQUIRED_FIELDS = ("language_code", "source_language", "target_language")
 
-@app.route("/youtube", methods=["POST"])
-def youtube() -> Response:
+# Pipeline jobs run on a background worker, one at a time since they share local and blob file names.
+# Jobs are only known to this process, which matches the single gunicorn worker and the single, always running
+# Cloud Run instance. They are lost when the instance restarts.
+# Only the latest MAX_FINISHED_JOBS finished jobs are kept, queued and running jobs are never evicted.
+MAX_FINISHED_JOBS = int(os.getenv("MAX_FINISHED_JOBS", 100))
+job_executor = ThreadPoolExecutor(max_workers=1)
+jobs: Dict[str, Future] = {}
+_jobs_lock = threading.Lock()
+
+
+def process_youtube_link(youtube_link: str, language_code: str, source_language: str, target_language: str) -> None:
     """
-    This function handles the POST request for the "/youtube" endpoint.
+    Download a YouTube video and generate its subtitles.
 
-    Example payload:
-        payload = {
-        "link": "https://www.youtube.com/watch?v=XJNO492juTE",
-        "language_code": "de_DE",
-        "source_language": "de",
-        "target_language": "en"
-        }
+    Args:
+        youtube_link (str): The YouTube video link.
+        language_code (str): The language code for speech recognition.
+        source_language (str): The source language for translation.
+        target_language (str): The target language for translation.
 
     Returns:
-        Response: The response object containing the result of the request.
+        None
     """
+    # video
+    video_filename = "video.mp4"
+    video_blob_name = f"videos/{video_filename}"
 
-    payload = request.get_json()
+    # audio
+    audio_filename = "audio.wav"
 
-    # Check if all required fields are present - if not return error
-    required_fields = ["link", "language_code", "source_language", "target_language"]
-    msg = helpers.check_payload_fields(required_fields, payload)
-    if msg:
-        return Response(msg, 400, response_headers)
+    # translation_api
+    gcs_uri_text_translation_result = f"gs://{BUCKET_NAME}/translated_texts/{target_language}/"
+
+    # speech_to_text_api
+    gcs_uri_text_speech2text_result = f"gs://{BUCKET_NAME}/texts/{source_language}.txt"
+
+    # Download YouTube video
+    video_path_local = helpers.download_youtube_video(link=youtube_link, video_filename=video_filename)
 
+    # clean up also if the job fails; leaving the executor waits for the upload to stop reading the video first
+    try:
+        video_info = helpers.get_video_info(video_path_local)
+
+        # The pipeline only reads the local copy, so upload the video to Cloud Storage in the background.
+        # Store the audio properties with the video so later /video_file runs can skip mediainfo.
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            video_upload = executor.submit(helpers.upload_blob, bucket_name=BUCKET_NAME,
+                                           source_file_name=video_path_local,
+                                           destination_blob_name=video_blob_name,
+                                           metadata=dict(zip(helpers.VIDEO_INFO_KEYS, video_info)))
+
+            process.process_video(PROJECT_ID=PROJECT_ID,
+                                  BUCKET_NAME=BUCKET_NAME,
+                                  video_path_local=video_path_local,
+                                  location=location,
+                                  language_code=language_code,
+                                  source_language=source_language,
+                                  target_language=target_language,
+                                  audio_filename=audio_filename,
+                                  gcs_uri_text_speech2text_result=gcs_uri_text_speech2text_result,
+                                  gcs_uri_text_translation_result=gcs_uri_text_translation_result,
+                                  video_info=video_info)
+
+            video_upload.result()
+    finally:
+        helpers.clean_up([video_path_local])
+
+
+def process_video_file(language_code: str, source_language: str, target_language: str) -> None:
+    """
+    Download the video file from Cloud Storage and generate its subtitles.
+
+    Args:
+        language_code (str): The language code for speech recognition.
+        source_language (str): The source language for translation.
+        target_language (str): The target language for translation.
+
+    Returns:
+        None
+    """
     # video
-    youtube_link = payload["link"]
     video_filename = "video.mp4"
     video_blob_name = f"videos/{video_filename}"
-    gcs_uri_video = f"gs://{BUCKET_NAME}/{video_blob_name}"
 
     # audio
     audio_filename = "audio.wav"
-    audio_blob_name = f"audios/{audio_filename}"
-    gcs_uri_audio = f"gs://{BUCKET_NAME}/{audio_blob_name}"
 
     # translation_api
-    source_language = payload["source_language"]  # de
-    target_language = payload["target_language"]  # en
     gcs_uri_text_translation_result = f"gs://{BUCKET_NAME}/translated_texts/{target_language}/"
 
     # speech_to_text_api
-    language_code = payload["language_code"]  # "de_DE"
     gcs_uri_text_speech2text_result = f"gs://{BUCKET_NAME}/texts/{source_language}.txt"
 
+    video_path_local = f"/Users/julius.haas/GCC_TryOuts/subtitle-generator/src/{video_filename}"
+
+    # clean up also if the job fails, including a partially downloaded video
     try:
-        # Download YouTube video and upload to Cloud Storage
-        video_path_local = helpers.download_youtube_video(link=youtube_link, video_filename=video_filename)
+        # download file from cloud storage to current directory
+        helpers.download_blob(bucket_name=BUCKET_NAME,
+                              source_blob_name=video_blob_name,
+                              destination_file_name=video_path_local)
 
-        helpers.upload_blob(bucket_name=BUCKET_NAME, source_file_name=video_path_local,
-                            destination_blob_name=video_blob_name)
+        # reuse audio properties stored with the video, probe and store them on the first run
+        video_info = helpers.get_blob_video_info(bucket_name=BUCKET_NAME, blob_name=video_blob_name)
+        if video_info is None:
+            video_info = helpers.get_video_info(video_path_local)
+            helpers.set_blob_video_info(bucket_name=BUCKET_NAME, blob_name=video_blob_name, video_info=video_info)
 
         process.process_video(PROJECT_ID=PROJECT_ID,
                               BUCKET_NAME=BUCKET_NAME,
@@ -87,97 +153,140 @@ def youtube() -> Response:
                               source_language=source_language,
                               target_language=target_language,
                               audio_filename=audio_filename,
-                              gcs_uri_audio=gcs_uri_audio,
                               gcs_uri_text_speech2text_result=gcs_uri_text_speech2text_result,
-                              gcs_uri_text_translation_result=gcs_uri_text_translation_result)
+                              gcs_uri_text_translation_result=gcs_uri_text_translation_result,
+                              video_info=video_info)
+    finally:
+        helpers.clean_up([video_path_local])
 
-        response = "Success"
-
-        return Response(response, status=200, headers=response_headers)
 
+def _run_job(job_id: str, job: Callable[..., None], **kwargs) -> None:
+    """
+    Run a pipeline job and log its failure. The exception is kept on the job's future for the status endpoint.
+    """
+    try:
+        job(**kwargs)
     except Exception as error:
-        msg = "Failed to extract the message length. Error: {}".format(error)
-        logger.error(msg)
-        return Response(msg, status=500, headers=response_headers)
+        logger.error("Job {} failed. Error: {}".format(job_id, error))
+        raise
 
 
-@app.route("/video_file", methods=["POST"])
-def video_file() -> Response:
+def submit_job(job: Callable[..., None], **kwargs) -> Response:
     """
-    Handle the video file endpoint.
+    Queue a pipeline job on the background worker.
 
-    This function processes the video file specified in the payload and performs various operations on it,
-    including downloading, audio extraction, speech-to-text conversion, translation, and subtitle generation.
+    Args:
+        job (Callable[..., None]): The pipeline function to run.
+        **kwargs: The keyword arguments passed to the pipeline function.
+
+    Returns:
+        Response: A 202 response containing the job ID to poll at "/status/<job_id>".
+    """
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        # jobs are kept in submission order, so the first finished ones are the oldest
+        finished_job_ids = [finished_job_id for finished_job_id, future in jobs.items() if future.done()]
+        for finished_job_id in finished_job_ids[:max(0, len(finished_job_ids) - MAX_FINISHED_JOBS)]:
+            del jobs[finished_job_id]
+        jobs[job_id] = job_executor.submit(_run_job, job_id, job, **kwargs)
+
+    return _response(json.dumps({"job_id": job_id}), status=202)
+
+
+@app.route("/youtube", methods=["POST"])
+def youtube() -> Response:
+    """
+    This function handles the POST request for the "/youtube" endpoint.
+
+    The video is processed in the background; poll "/status/<job_id>" for the result.
 
     Example payload:
         payload = {
+        "link": "https://www.youtube.com/watch?v=XJNO492juTE",
         "language_code": "de_DE",
         "source_language": "de",
         "target_language": "en"
         }
 
     Returns:
-        Response: The response object with the status and headers.
-
-    Raises:
-        Exception: If an error occurs during the processing.
-
+        Response: The response object containing the job ID of the request.
     """
 
     payload = request.get_json()
 
     # Check if all required fields are present - if not return error
-    required_fields = ["language_code", "source_language", "target_language"]
-    msg = helpers.check_payload_fields(required_fields, payload)
+    msg = helpers.check_payload_fields(YOUTUBE_REQUIRED_FIELDS, payload)
     if msg:
-        return Response(msg, 400, response_headers)
+        return _response(msg, status=400)
 
-    # video
-    video_filename = "video.mp4"
-    video_blob_name = f"videos/{video_filename}"
-    gcs_uri_video = f"gs://{BUCKET_NAME}/{video_blob_name}"
+    return submit_job(process_youtube_link,
+                      youtube_link=payload["link"],
+                      language_code=payload["language_code"],  # "de_DE"
+                      source_language=payload["source_language"],  # de
+                      target_language=payload["target_language"])  # en
 
-    # audio
-    audio_filename = "audio.wav"
-    audio_blob_name = f"audios/{audio_filename}"
-    gcs_uri_audio = f"gs://{BUCKET_NAME}/{audio_blob_name}"
 
-    # translation_api
-    source_language = payload["source_language"]  # de
-    target_language = payload["target_language"]  # en
-    gcs_uri_text_translation_result = f"gs://{BUCKET_NAME}/translated_texts/{target_language}/"
+@app.route("/video_file", methods=["POST"])
+def video_file() -> Response:
+    """
+    Handle the video file endpoint.
 
-    # speech_to_text_api
-    language_code = payload["language_code"]  # "de_DE"
-    gcs_uri_text_speech2text_result = f"gs://{BUCKET_NAME}/texts/{source_language}.txt"
+    This function queues the processing of the video file specified in the payload, which performs various
+    operations on it, including downloading, audio extraction, speech-to-text conversion, translation, and subtitle
+    generation. Poll "/status/<job_id>" for the result.
 
-    try:
-        # download file from cloud storage to current directory
-        video_path_local = f"/Users/julius.haas/GCC_TryOuts/subtitle-generator/src/{video_filename}"
-        helpers.download_blob(bucket_name=BUCKET_NAME,
-                              source_blob_name=video_blob_name,
-                              destination_file_name=video_path_local)
+    Example payload:
+        payload = {
+        "language_code": "de_DE",
+        "source_language": "de",
+        "target_language": "en"
+        }
 
-        process.process_video(PROJECT_ID=PROJECT_ID,
-                              BUCKET_NAME=BUCKET_NAME,
-                              video_path_local=video_path_local,
-                              location=location,
-                              language_code=language_code,
-                              source_language=source_language,
-                              target_language=target_language,
-                              audio_filename=audio_filename,
-                              gcs_uri_audio=gcs_uri_audio,
-                              gcs_uri_text_speech2text_result=gcs_uri_text_speech2text_result,
-                              gcs_uri_text_translation_result=gcs_uri_text_translation_result)
+    Returns:
+        Response: The response object containing the job ID of the request.
 
-        response = "Success"
+    """
 
-        return Response(response, status=200, headers=response_headers)
+    payload = request.get_json()
 
-    except Exception as error:
-        msg = "Failed to extract the message length. Error: {}".format(error)
-        logger.error(msg)
-        return Response(msg, status=500, headers=response_headers)
+    # Check if all required fields are present - if not return error
+    msg = helpers.check_payload_fields(VIDEO_FILE_REQUIRED_FIELDS, payload)
+    if msg:
+        return _response(msg, status=400)
+
+    return submit_job(process_video_file,
+                      language_code=payload["language_code"],  # "de_DE"
+                      source_language=payload["source_language"],  # de
+                      target_language=payload["target_language"])  # en
+
+
+@app.route("/status/<job_id>", methods=["GET"])
+def status(job_id: str) -> Response:
+    """
+    Report the state of a job queued by "/youtube" or "/video_file".
+
+    The state is one of "queued", "running", "success" or "failed"; failed jobs also carry the error message.
+
+    Returns:
+        Response: The response object containing the job state, or 404 if the job is unknown or was evicted.
+    """
+    with _jobs_lock:
+        job = jobs.get(job_id)
+    if job is None:
+        return _response(f"Unknown job {job_id}", status=404)
+
+    result = {"job_id": job_id}
+    if job.running():
+        result["status"] = "running"
+    elif not job.done():
+        result["status"] = "queued"
+    elif job.exception() is not None:
+        result["status"] = "failed"
+        result["error"] = str(job.exception())
+    else:
+        result["status"] = "success"
+
+    return _response(json.dumps(result), status=200)
 
 
 if __name__ == "__main__":
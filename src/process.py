@@ -1,13 +1,57 @@
-from typing import List
+from typing import List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import math
+import os
+import threading
 from google.cloud import speech, translate
-from time import sleep
 import srt
 from src import helpers
 
+# upper bounds for a batch translation and for the recognition of one audio segment to finish before giving up
+TRANSLATION_TIMEOUT_SECS = 1800
+RECOGNITION_TIMEOUT_SECS = 1800
+
+# the audio is transcribed in windows of this length, AUDIO_CONCURRENCY at a time
+AUDIO_SEGMENT_SECS = 600
+AUDIO_CONCURRENCY = int(os.getenv("AUDIO_CONCURRENCY", 3))
+
+# punctuation that ends a subtitle
+_SENTENCE_TERMINALS = frozenset(".!?")
+
+# shared clients, their gRPC channels are thread-safe and reused across segments and requests.
+# They are created on first use, so the module can be imported without credentials.
+_SPEECH_CLIENT: Optional[speech.SpeechClient] = None
+_TRANSLATE_CLIENT: Optional[translate.TranslationServiceClient] = None
+_CLIENTS_LOCK = threading.Lock()
+
+
+def _get_speech_client() -> speech.SpeechClient:
+    """
+    Return the shared speech client, creating it on the first call.
+    """
+    global _SPEECH_CLIENT
+    with _CLIENTS_LOCK:
+        if _SPEECH_CLIENT is None:
+            _SPEECH_CLIENT = speech.SpeechClient()
+    return _SPEECH_CLIENT
+
+
+def _get_translate_client() -> translate.TranslationServiceClient:
+    """
+    Return the shared translation client, creating it on the first call.
+    """
+    global _TRANSLATE_CLIENT
+    with _CLIENTS_LOCK:
+        if _TRANSLATE_CLIENT is None:
+            _TRANSLATE_CLIENT = translate.TranslationServiceClient()
+    return _TRANSLATE_CLIENT
+
 
 def process_video(PROJECT_ID: str, BUCKET_NAME: str, video_path_local: str, location: str, language_code: str,
-                  source_language: str, target_language: str, audio_filename: str, gcs_uri_audio: str,
-                  gcs_uri_text_speech2text_result: str, gcs_uri_text_translation_result: str) -> None:
+                  source_language: str, target_language: str, audio_filename: str,
+                  gcs_uri_text_speech2text_result: str, gcs_uri_text_translation_result: str,
+                  video_info: Optional[Tuple[int, int, int, float]] = None) -> None:
     """
     Process the video by performing speech-to-text transcription, translation, and generating subtitles.
 
@@ -19,20 +63,21 @@ def process_video(PROJECT_ID: str, BUCKET_NAME: str, video_path_local: str, loca
         language_code (str): The language code for speech recognition.
         source_language (str): The source language for translation.
         target_language (str): The target language for translation.
-        audio_filename (str): The filename of the audio file.
-        gcs_uri_audio (str): The GCS URI of the audio file.
+        audio_filename (str): The filename of the audio file, suffixed with the segment number per audio segment.
         gcs_uri_text_speech2text_result (str): The GCS URI of the speech-to-text result.
         gcs_uri_text_translation_result (str): The GCS URI of the translation result.
+        video_info (Tuple[int, int, int, float], optional): The channels, bit rate, sample rate and duration of the
+            video, if already known. Defaults to None, in which case they are read from the local video file.
 
     """
-    channels, bit_rate, sample_rate = helpers.get_video_info(video_path_local)
+    if video_info is None:
+        video_info = helpers.get_video_info(video_path_local)
+    channels, bit_rate, sample_rate, duration = video_info
 
-    gcs_uri = helpers.video_to_audio(video_path_local, audio_filename, channels, bit_rate, sample_rate)
-    assert gcs_uri == gcs_uri_audio
+    subtitles = transcribe_video(video_path_local, audio_filename, language_code, channels, bit_rate, sample_rate,
+                                 duration)
 
-    subtitles = long_running_recognize(gcs_uri_audio, language_code, channels, sample_rate)
-
-    helpers.write_srt(bucket_name=BUCKET_NAME, subtitles=subtitles, language=source_language)
+    source_srt = helpers.write_srt(subtitles=subtitles, language=source_language)
     helpers.write_txt(bucket_name=BUCKET_NAME, subtitles=subtitles, language=source_language)
 
     batch_translate_text(input_uri=gcs_uri_text_speech2text_result,
@@ -46,13 +91,77 @@ def process_video(PROJECT_ID: str, BUCKET_NAME: str, video_path_local: str, loca
                                                          source_blob_name=f"translated_texts/{target_language}/subtitle-generator-bucket_texts_{source_language}_{target_language}_translations.txt")
 
     helpers.update_srt(original_subtitles=subtitles, translated_text=translated_text)
-    helpers.write_srt(bucket_name=BUCKET_NAME, subtitles=subtitles, language=target_language)
+    target_srt = helpers.write_srt(subtitles=subtitles, language=target_language)
 
-    helpers.clean_up()
+    # upload both subtitle files in one batch
+    helpers.upload_blobs(bucket_name=BUCKET_NAME, file_blob_names=[source_srt, target_srt],
+                         content_type="text/plain")
 
 
 # SPEECH-TO-SRT
-def long_running_recognize(gcs_uri: str, language_code: str, channels: int, sample_rate: int) -> List[srt.Subtitle]:
+def transcribe_video(video_path_local: str, audio_filename: str, language_code: str, channels: int, bit_rate: str,
+                     sample_rate: int, duration: float) -> List[srt.Subtitle]:
+    """
+    Transcribe fixed-length audio segments of the video concurrently and stitch them back together in order.
+
+    Args:
+        video_path_local (str): The local path of the video file.
+        audio_filename (str): The filename of the audio file, suffixed with the segment number per audio segment.
+        language_code (str): The language code for speech recognition.
+        channels (int): The number of audio channels.
+        bit_rate (str): The audio bit rate.
+        sample_rate (int): The sample rate of the audio.
+        duration (float): The duration of the video in seconds.
+
+    Returns:
+        List[srt.Subtitle]: The subtitles of the whole video, numbered from 1.
+
+    """
+    segment_count = max(1, math.ceil(float(duration) / AUDIO_SEGMENT_SECS))
+    with ThreadPoolExecutor(max_workers=AUDIO_CONCURRENCY) as executor:
+        segments = [executor.submit(transcribe_segment, video_path_local, audio_filename, segment_index,
+                                    language_code, channels, bit_rate, sample_rate)
+                    for segment_index in range(segment_count)]
+        subtitles = [subtitle for segment in segments for subtitle in segment.result()]
+
+    for index, subtitle in enumerate(subtitles, start=1):
+        subtitle.index = index
+
+    return subtitles
+
+
+def transcribe_segment(video_path_local: str, audio_filename: str, segment_index: int, language_code: str,
+                       channels: int, bit_rate: str, sample_rate: int) -> List[srt.Subtitle]:
+    """
+    Extract one audio segment of the video, upload it and transcribe it.
+
+    Args:
+        video_path_local (str): The local path of the video file.
+        audio_filename (str): The filename of the audio file, suffixed with the segment number.
+        segment_index (int): The position of the segment, which starts at segment_index * AUDIO_SEGMENT_SECS.
+        language_code (str): The language code for speech recognition.
+        channels (int): The number of audio channels.
+        bit_rate (str): The audio bit rate.
+        sample_rate (int): The sample rate of the audio.
+
+    Returns:
+        List[srt.Subtitle]: The subtitles of the segment, timed relative to the start of the video.
+
+    """
+    audio_name, audio_extension = os.path.splitext(audio_filename)
+    segment_filename = f"{audio_name}_{segment_index:03d}{audio_extension}"
+    segment_start = segment_index * AUDIO_SEGMENT_SECS
+
+    helpers.video_to_audio(video_path_local, segment_filename, channels, bit_rate, sample_rate,
+                           start=segment_start, duration=AUDIO_SEGMENT_SECS)
+    gcs_uri_audio = f"gs://{helpers.BUCKET_NAME}/audios/{segment_filename}"
+
+    return long_running_recognize(gcs_uri_audio, language_code, channels, sample_rate,
+                                  offset=timedelta(seconds=segment_start))
+
+
+def long_running_recognize(gcs_uri: str, language_code: str, channels: int, sample_rate: int,
+                           offset: timedelta = timedelta(0)) -> List[srt.Subtitle]:
     """
     Perform long running speech recognition on the audio file.
 
@@ -61,12 +170,13 @@ def long_running_recognize(gcs_uri: str, language_code: str, channels: int, samp
         language_code (str): The language code for speech recognition.
         channels (int): The number of audio channels.
         sample_rate (int): The sample rate of the audio.
+        offset (timedelta, optional): The time added to each subtitle, i.e. the start of the audio within the
+            video. Defaults to timedelta(0).
 
     Returns:
         List[srt.Subtitle]: The list of generated subtitles.
 
     """
-    client = speech.SpeechClient()
     config = speech.RecognitionConfig(
         language_code=language_code,
         encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
@@ -77,10 +187,10 @@ def long_running_recognize(gcs_uri: str, language_code: str, channels: int, samp
     )
     audio = speech.RecognitionAudio(uri=gcs_uri)
 
-    operation = client.long_running_recognize(config=config, audio=audio)
+    operation = _get_speech_client().long_running_recognize(config=config, audio=audio)
 
     print("Waiting for operation to complete...")
-    response = operation.result()
+    response = operation.result(timeout=RECOGNITION_TIMEOUT_SECS)
 
     subs = []
 
@@ -88,6 +198,10 @@ def long_running_recognize(gcs_uri: str, language_code: str, channels: int, samp
         # First alternative is the most probable result
         subs = break_sentences(subs, result.alternatives[0])
 
+    for sub in subs:
+        sub.start += offset
+        sub.end += offset
+
     print("Transcribing finished")
     return subs
 
@@ -108,30 +222,31 @@ def break_sentences(subs: List[srt.Subtitle], alternative) -> List[srt.Subtitle]
     max_chars = 40
     charcount = 0
     idx = len(subs) + 1
-    content = ""
+    words = []
 
     for w in alternative.words:
         if firstword:
             # first word in sentence, record start time
             start = w.start_time
 
-        charcount += len(w.word)
-        content += " " + w.word.strip()
+        word = w.word
+        charcount += len(word)
+        words.append(word.strip())
 
-        if ("." in w.word or "!" in w.word or "?" in w.word or
+        if (not _SENTENCE_TERMINALS.isdisjoint(word) or
                 charcount > max_chars or
-                ("," in w.word and not firstword)):
+                ("," in word and not firstword)):
             # break sentence at: . ! ? or line length exceeded
             # also break if , and not first word
             subs.append(srt.Subtitle(
                 index=idx,
                 start=start,
                 end=w.end_time,
-                content=srt.make_legal_content(content)
+                content=srt.make_legal_content(" ".join(words))
             ))
             firstword = True
             idx += 1
-            content = ""
+            words.clear()
             charcount = 0
         else:
             firstword = False
@@ -152,9 +267,8 @@ def get_supported_languages(PROJECT_ID: str, location: str) -> None:
         None
 
     """
-    client = translate.TranslationServiceClient()
     parent = f"projects/{PROJECT_ID}/locations/{location}"
-    response = client.get_supported_languages(parent=parent)
+    response = _get_translate_client().get_supported_languages(parent=parent)
 
     # List language codes of supported languages
     print('Supported Languages: ', end='')
@@ -179,8 +293,6 @@ def batch_translate_text(input_uri: str, output_uri: str, project_id: str, locat
         None
 
     """
-    client = translate.TranslationServiceClient()
-
     target_language_codes = target_language.split(",")
     gcs_source = {"input_uri": input_uri}
     mime_type = "text/plain"
@@ -190,7 +302,7 @@ def batch_translate_text(input_uri: str, output_uri: str, project_id: str, locat
     output_config = {"gcs_destination": gcs_destination}
     parent = f"projects/{project_id}/locations/{location}"
 
-    operation = client.batch_translate_text(
+    operation = _get_translate_client().batch_translate_text(
         request={
             "parent": parent,
             "source_language_code": source_language,
@@ -200,19 +312,7 @@ def batch_translate_text(input_uri: str, output_uri: str, project_id: str, locat
         }
     )
 
-    # Initial delay
-    total_wait_secs = 60
-    print(f"Waiting for operation to complete... {total_wait_secs:.0f} secs")
-
-    delay_secs = 10
-    sleep(total_wait_secs)
-    while not operation.done():
-        # Exponential backoff
-        delay_secs *= 1.1
-        total_wait_secs += delay_secs
-        print(f"Checking again in: {delay_secs:.0f} seconds | total wait: {total_wait_secs:.0f} secs")
-        sleep(delay_secs)
-
-    response = operation.result()
+    print("Waiting for operation to complete...")
+    response = operation.result(timeout=TRANSLATION_TIMEOUT_SECS)
     print(u"Total Characters: {}".format(response.total_characters))
     print(u"Translated Characters: {}".format(response.translated_characters))
@@ -1,6 +1,7 @@
 # todo: implement unit tests
 
 from src import main
+import time
 import pytest
 from flask import Response
 
@@ -19,6 +20,27 @@ def client():
         yield client
 
 
+def _wait_for_job(client, job_id: str, timeout_secs: int = 3600) -> str:
+    """
+    Poll the `/status/<job_id>` endpoint until the job has finished.
+
+    Args:
+        client (FlaskClient): The Flask test client.
+        job_id (str): The id of the job to wait for.
+        timeout_secs (int): The maximum time to wait.
+
+    Returns:
+        str: The final status of the job.
+    """
+    deadline = time.time() + timeout_secs
+    while time.time() < deadline:
+        job_status = client.get(f'/status/{job_id}').get_json()["status"]
+        if job_status not in ('queued', 'running'):
+            return job_status
+        time.sleep(5)
+    return 'timeout'
+
+
 def test_youtube_endpoint(client):
     """
     Test the `/youtube` endpoint.
@@ -40,11 +62,11 @@ def test_youtube_endpoint(client):
     # Send a POST request to the `/youtube` endpoint
     response: Response = client.post('/youtube', json=payload)
 
-    # Assert the response status code is 200
-    assert response.status_code == 200
+    # Assert the job was accepted
+    assert response.status_code == 202
 
-    # Assert the response data is 'Success'
-    assert response.data.decode() == 'Success'
+    # Assert the job finishes successfully
+    assert _wait_for_job(client, response.get_json()["job_id"]) == 'success'
 
 
 def test_video_file_endpoint(client):
@@ -67,8 +89,50 @@ def test_video_file_endpoint(client):
     # Send a POST request to the `/video_file` endpoint
     response: Response = client.post('/video_file', json=payload)
 
-    # Assert the response status code is 200
-    assert response.status_code == 200
+    # Assert the job was accepted
+    assert response.status_code == 202
+
+    # Assert the job finishes successfully
+    assert _wait_for_job(client, response.get_json()["job_id"]) == 'success'
+
+
+def test_status_endpoint_unknown_job(client):
+    """
+    Test the `/status/<job_id>` endpoint for a job that was never submitted.
+
+    Args:
+        client (FlaskClient): The Flask test client.
+
+    Returns:
+        None
+    """
+    # Send a GET request for a job id that does not exist
+    response: Response = client.get('/status/unknown')
+
+    # Assert the response status code is 404
+    assert response.status_code == 404
 
-    # Assert the response data is 'Success'
-    assert response.data.decode() == 'Success'
+
+def test_status_endpoint_evicts_oldest_finished_jobs(client, monkeypatch):
+    """
+    Test that only the latest `MAX_FINISHED_JOBS` finished jobs are kept for the `/status/<job_id>` endpoint.
+
+    Args:
+        client (FlaskClient): The Flask test client.
+        monkeypatch (MonkeyPatch): The pytest monkeypatch fixture.
+
+    Returns:
+        None
+    """
+    monkeypatch.setattr(main, "MAX_FINISHED_JOBS", 1)
+
+    # Submit three jobs that finish immediately, each one waiting for the previous job to finish
+    job_ids = []
+    for _ in range(3):
+        job_ids.append(main.submit_job(lambda: None).get_json()["job_id"])
+        assert _wait_for_job(client, job_ids[-1]) == 'success'
+
+    # Assert the oldest job was evicted, while the latest finished ones are still known
+    assert client.get(f'/status/{job_ids[0]}').status_code == 404
+    assert client.get(f'/status/{job_ids[1]}').get_json()["status"] == 'success'
+    assert client.get(f'/status/{job_ids[2]}').get_json()["status"] == 'success'
@@ -0,0 +1,56 @@
+from datetime import timedelta
+from types import SimpleNamespace
+
+from src import process
+
+
+class FakeSpeechClient:
+    """
+    A stand-in for the speech client that returns a canned transcript per audio URI.
+    """
+
+    def __init__(self, transcripts: dict):
+        self.transcripts = transcripts
+
+    def long_running_recognize(self, config, audio):
+        words = [SimpleNamespace(word=word, start_time=timedelta(seconds=start), end_time=timedelta(seconds=end))
+                 for word, start, end in self.transcripts[audio.uri]]
+        response = SimpleNamespace(results=[SimpleNamespace(alternatives=[SimpleNamespace(words=words)])])
+        return SimpleNamespace(result=lambda timeout=None: response)
+
+
+def test_transcribe_video_stitches_segments(monkeypatch):
+    """
+    Test that `transcribe_video` offsets, orders and renumbers the subtitles of all audio segments.
+
+    Args:
+        monkeypatch (MonkeyPatch): The pytest monkeypatch fixture.
+
+    Returns:
+        None
+    """
+    # Record the audio segments instead of running ffmpeg
+    extracted = []
+    monkeypatch.setattr(process.helpers, "video_to_audio",
+                        lambda video_path, audio_filename, *args, start, duration: extracted.append(
+                            (audio_filename, start, duration)))
+    monkeypatch.setattr(process.helpers, "BUCKET_NAME", "bucket")
+
+    # One sentence in each of the two segments of a 15 minute video
+    monkeypatch.setattr(process, "_SPEECH_CLIENT", FakeSpeechClient({
+        "gs://bucket/audios/audio_000.wav": [("Hallo", 1, 2), ("Welt.", 2, 3)],
+        "gs://bucket/audios/audio_001.wav": [("Tschüss.", 3, 4)],
+    }))
+
+    subtitles = process.transcribe_video("video.mp4", "audio.wav", "de_DE", 2, "128000", 44100, 900.0)
+
+    # Assert both segments were extracted with their offsets
+    assert sorted(extracted) == [("audio_000.wav", 0, 600), ("audio_001.wav", 600, 600)]
+
+    # Assert the second segment's subtitle is shifted by the segment start and numbered after the first
+    assert [subtitle.index for subtitle in subtitles] == [1, 2]
+    assert [subtitle.content for subtitle in subtitles] == ["Hallo Welt.", "Tschüss."]
+    assert subtitles[0].start == timedelta(seconds=1)
+    assert subtitles[0].end == timedelta(seconds=3)
+    assert subtitles[1].start == timedelta(seconds=603)
+    assert subtitles[1].end == timedelta(seconds=604)